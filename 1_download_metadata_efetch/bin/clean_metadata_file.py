@@ -1,66 +1,88 @@
 import argparse
+import re
 
 import pandas as pd
 
+# Arrow-backed strings let the .str/isin filters below run as Arrow compute
+# kernels; fall back to plain object columns when pyarrow is missing or too
+# old for this pandas version (constructing the dtype checks both)
+try:
+    STRING_DTYPE = pd.StringDtype("pyarrow")
+except ImportError:
+    STRING_DTYPE = None
+
+# Only the filter columns are cast; Run and Experiment stay object dtype since
+# the groupby/';'.join merge is markedly slower on Arrow strings
+STRING_COLUMNS = ["LibraryLayout", "ScientificName"]
+
 
 def main(infile, outfile, layout, strain=None):
 
     # Read in metadata with one SRR as row
     DF_SRR = pd.read_csv(infile, header=0)
 
-    # Merge internal tables
-    DF_SRR = DF_SRR[~DF_SRR.Run.isin(["", "Run"])]
+    # Merge internal tables (drop repeated header rows and rows without a Run)
+    run = DF_SRR["Run"]
+    DF_SRR = DF_SRR[run.notna() & (run != "") & (run != "Run")]
 
     # Merge rows so it has one SRX per row
-    agg_rules = {col: ";".join if col == "Run" else "last" for col in DF_SRR.columns}
-    DF_SRX = DF_SRR.groupby("Experiment").agg(agg_rules)
+    # (last non-null value per column, all Run accessions joined by ';')
+    grouped = DF_SRR.groupby("Experiment")
+    DF_SRX = grouped.last()
+    DF_SRX["Run"] = grouped["Run"].agg(";".join)
 
-    DF_SRX.set_index("Experiment", inplace=True)
+    # Store the columns used for filtering as Arrow strings
+    if STRING_DTYPE is not None:
+        cols = [c for c in STRING_COLUMNS if c in DF_SRX.columns]
+        DF_SRX[cols] = DF_SRX[cols].astype(STRING_DTYPE)
 
     # Add R1 and R2 columns
     DF_SRX["R1"] = None
     DF_SRX["R2"] = None
 
-    # Sort rows by ReleaseDate descending
-    if 'ReleaseDate' in DF_SRX.columns:
-        DF_SRX['ReleaseDate'] = pd.to_datetime(DF_SRX['ReleaseDate'], format='%Y-%m-%d', errors='coerce')
-        DF_SRX = DF_SRX.sort_values('ReleaseDate', ascending=False)
-
     # Filter by LibraryLayout parameter
+    # - runinfo layouts are normally upper case already, so match the raw
+    #   values first and only upper-case the rows that did not match
     if 'LibraryLayout' in DF_SRX.columns:
-        lib_vals = DF_SRX['LibraryLayout'].str.upper()
         if layout.lower() == 'paired':
-            DF_SRX = DF_SRX[ lib_vals == 'PAIRED' ]
+            targets = ['PAIRED']
         elif layout.lower() == 'single':
-            DF_SRX = DF_SRX[ lib_vals == 'SINGLE' ]
+            targets = ['SINGLE']
         else:
-            DF_SRX = DF_SRX[ lib_vals.isin(['PAIRED','SINGLE']) ]
+            targets = ['PAIRED','SINGLE']
+        lib_vals = DF_SRX['LibraryLayout']
+        keep = lib_vals.isin(targets)
+        if not keep.all():
+            keep[~keep] = lib_vals[~keep].str.upper().isin(targets)
+        DF_SRX = DF_SRX[keep]
 
     # Optional: Filter by strain using ScientificName column
-    # - Split ScientificName by spaces and keep rows where any token equals
-    #   or contains the provided strain string (case-insensitive)
+    # - Keep rows where the (case-insensitive) strain string occurs in
+    #   ScientificName; for a single-token query this is the same as any
+    #   space-delimited token equalling or containing it
     if strain:
         col = 'ScientificName'
         if col in DF_SRX.columns:
-            s = DF_SRX[col].fillna("").astype(str)
+            s = DF_SRX[col].fillna("").astype(STRING_DTYPE or str)
             query = str(strain).strip()
             if query:
-                qlower = query.lower()
-                def match_tokens(name: str) -> bool:
-                    tokens = name.split()
-                    for t in tokens:
-                        tlower = t.lower()
-                        if tlower == qlower or (qlower in tlower):
-                            return True
-                    return False
-                mask = s.apply(match_tokens)
+                pat = re.escape(query.lower())
+                mask = s.str.lower().str.contains(pat, regex=True, na=False)
                 DF_SRX = DF_SRX[mask]
 
+    # Sort rows by ReleaseDate descending (after filtering, so only kept rows
+    # are parsed and sorted; a stable sort keeps the result order-independent)
+    if 'ReleaseDate' in DF_SRX.columns:
+        DF_SRX['ReleaseDate'] = pd.to_datetime(DF_SRX['ReleaseDate'], format='%Y-%m-%d', errors='coerce', cache=True)
+        DF_SRX = DF_SRX.sort_values('ReleaseDate', ascending=False, kind='mergesort')
+
     # Save to file
     DF_SRX.to_csv(outfile, sep="\t")
 
-    # Save only sample IDs (first column) to CSV without header
-    pd.Series(DF_SRX.index).to_csv('sample_id.csv', index=False, header=True)
+    # Save only sample IDs (first column) to a single-column CSV with header
+    with open('sample_id.csv', 'w') as f:
+        f.write("Experiment\n")
+        f.writelines(f"{sample_id}\n" for sample_id in DF_SRX.index)
 
 
 if __name__ == "__main__":
@@ -69,7 +91,7 @@ if __name__ == "__main__":
     p.add_argument("-i", "--input", help="Input filename")
     p.add_argument("-o", "--output", help="Output filename")
     p.add_argument("-l", "--layout", choices=['paired','single','both'], default='both', help="Library layout to include: paired, single, or both")
-    p.add_argument("--strain", default=None, help="Optional strain filter applied to ScientificName; matches if any space-delimited token equals or contains the provided string (case-insensitive)")
+    p.add_argument("--strain", default=None, help="Optional strain filter applied to ScientificName; keeps rows whose ScientificName contains the provided string (case-insensitive substring match)")
     args = p.parse_args()
 
     main(args.input, args.output, args.layout, args.strain)
@@ -200,6 +200,27 @@ import os
 import pandas as pd
 import numpy as np
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+# Use Arrow's multi-threaded CSV reader for quant.sf files when available
+try:
+    import pyarrow.csv as pacsv
+except ImportError:
+    pacsv = None
+
+QUANT_COLUMNS = ['Name', 'Length', 'TPM', 'NumReads']
+
+def load_quant(quant_file):
+    # Read the per-gene Length, TPM and NumReads columns, indexed by gene ID
+    if pacsv is not None:
+        table = pacsv.read_csv(
+            quant_file,
+            read_options=pacsv.ReadOptions(use_threads=True),
+            parse_options=pacsv.ParseOptions(delimiter='\\t'),
+            convert_options=pacsv.ConvertOptions(include_columns=QUANT_COLUMNS),
+        )
+        return table.to_pandas().set_index('Name')
+    return pd.read_csv(quant_file, sep='\\t', usecols=QUANT_COLUMNS, index_col='Name')
 
 # Read passed sample IDs
 passed_sample_ids = set()
@@ -232,7 +253,7 @@ if failed_samples:
 
 # Group by experiment ID and collect data
 experiment_data = defaultdict(list)
-gene_ids = None
+samples_to_load = []
 
 for quant_dir in quant_dirs:
     sample_name = quant_dir.replace('_quant', '')
@@ -249,25 +270,27 @@ for quant_dir in quant_dirs:
         print(f"Skipping {sample_name} (base sample {base_sample_name} not in passed samples)")
         continue
     
-    # Read quantification file
+    # Queue quantification file for reading
     quant_file = os.path.join(quant_dir, 'quant.sf')
     if not os.path.exists(quant_file):
         print(f"Warning: {quant_file} not found")
         continue
     
-    df = pd.read_csv(quant_file, sep='\\t')
-    
-    # Store gene IDs from first file
-    if gene_ids is None:
-        gene_ids = df['Name'].tolist()
-    
-    # Store counts and TPM data for this experiment
+    samples_to_load.append((experiment_id, sample_name, base_sample_name, quant_file))
+
+# Read quantification files in parallel (CSV parsing releases the GIL)
+with ThreadPoolExecutor(max_workers=min(32, max(1, len(samples_to_load)))) as executor:
+    quant_dfs = list(executor.map(load_quant, [s[3] for s in samples_to_load]))
+
+for (experiment_id, sample_name, base_sample_name, _), df in zip(samples_to_load, quant_dfs):
+    # Store counts and TPM data for this experiment (indexed by gene ID); the
+    # columns are copied so they do not keep the loaded frame's block alive
     experiment_data[experiment_id].append({
         'sample': sample_name,
         'base_sample': base_sample_name,
-        'counts': df['NumReads'].tolist(),
-        'tpm': df['TPM'].tolist(),
-        'length': df['Length'].tolist()
+        'counts': df['NumReads'].copy(),
+        'tpm': df['TPM'].copy(),
+        'length': df['Length']
     })
 
 print(f"Grouped into {len(experiment_data)} experiments")
@@ -286,58 +309,68 @@ for experiment_id, runs in experiment_data.items():
         print(f"Merging {len(runs)} runs for experiment {experiment_id}")
         
         # Sum counts across runs
-        summed_counts = [0] * len(gene_ids)
-        avg_lengths = [0] * len(gene_ids)
-        
-        for run in runs:
-            for i in range(len(gene_ids)):
-                summed_counts[i] += run['counts'][i]
-                avg_lengths[i] = run['length'][i]  # Length should be same across runs
+        summed_counts = pd.concat([run['counts'] for run in runs], axis=1).sum(axis=1)
+        lengths = runs[-1]['length'].reindex(summed_counts.index)  # Length should be same across runs
         
         # Calculate TPM from summed counts
         # TPM = (counts / length) * 1e6 / sum(counts / length)
-        rpk = [summed_counts[i] / avg_lengths[i] if avg_lengths[i] > 0 else 0 for i in range(len(gene_ids))]
-        scaling_factor = sum(rpk) / 1e6 if sum(rpk) > 0 else 1
-        recalculated_tpm = [rpk[i] / scaling_factor if scaling_factor > 0 else 0 for i in range(len(gene_ids))]
+        rpk = (summed_counts / lengths).where(lengths > 0, 0)
+        scaling_factor = rpk.sum() / 1e6 if rpk.sum() > 0 else 1
+        recalculated_tpm = rpk / scaling_factor
         
         # Use experiment ID as column header
         final_counts[experiment_id] = summed_counts
         final_tpm[experiment_id] = recalculated_tpm
 
+# Release the loaded quant.sf frames; from here on only the per-experiment
+# columns in final_counts and final_tpm are referenced
+quant_dfs = experiment_data = df = runs = None
+
+def build_matrix(columns, experiment_ids):
+    # Compute the union of gene IDs once, then fill a preallocated array
+    # column by column instead of hash-joining intermediate frames. Values
+    # keep their input dtype (float64), since they are written with up to
+    # 6 decimals and TPM can reach 1e6
+    genes = columns[experiment_ids[0]].index
+    for exp_id in experiment_ids[1:]:
+        if not columns[exp_id].index.equals(genes):
+            genes = genes.union(columns[exp_id].index, sort=False)
+    dtype = np.result_type(*(columns[exp_id].dtype for exp_id in experiment_ids))
+    values = np.zeros((len(genes), len(experiment_ids)), dtype=dtype)
+    for j, exp_id in enumerate(experiment_ids):
+        values[genes.get_indexer(columns[exp_id].index), j] = columns[exp_id].to_numpy()
+    return pd.DataFrame(values, index=genes, columns=experiment_ids)
+
 # Create output matrices
-if gene_ids and final_counts:
+if final_counts:
     # Sort experiment IDs for consistent output
     sorted_experiments = sorted(final_counts.keys())
     
+    # Align all experiments on gene ID (genes missing from a sample stay 0);
+    # each matrix is built, written and released before the next one
+    
     # Write counts matrix
-    with open('counts.csv', 'w') as f:
-        f.write('GeneID,' + ','.join(sorted_experiments) + '\\n')
-        for i, gene_id in enumerate(gene_ids):
-            f.write(gene_id)
-            for exp_id in sorted_experiments:
-                f.write(f',{final_counts[exp_id][i]}')
-            f.write('\\n')
+    counts_df = build_matrix(final_counts, sorted_experiments)
+    counts_df.to_csv('counts.csv', index_label='GeneID')
+    n_genes = len(counts_df)
+    del counts_df, final_counts
     
-    # Write TPM matrix  
-    with open('tpm.csv', 'w') as f:
-        f.write('GeneID,' + ','.join(sorted_experiments) + '\\n')
-        for i, gene_id in enumerate(gene_ids):
-            f.write(gene_id)
-            for exp_id in sorted_experiments:
-                f.write(f',{final_tpm[exp_id][i]:.6f}')
-            f.write('\\n')
+    # Write TPM matrix
+    tpm_df = build_matrix(final_tpm, sorted_experiments)
+    del final_tpm
+    tpm_df.to_csv('tpm.csv', index_label='GeneID', float_format='%.6f')
     
-    # Write log TPM matrix (log2(TPM + 1))
-    with open('log_tpm.csv', 'w') as f:
-        f.write('GeneID,' + ','.join(sorted_experiments) + '\\n')
-        for i, gene_id in enumerate(gene_ids):
-            f.write(gene_id)
-            for exp_id in sorted_experiments:
-                log_tpm = np.log2(final_tpm[exp_id][i] + 1)
-                f.write(f',{log_tpm:.6f}')
-            f.write('\\n')
+    # Write log TPM matrix (log2(TPM + 1)), converting the TPM values in place
+    # since tpm.csv has already been written
+    values = tpm_df.to_numpy()
+    np.add(values, 1, out=values)
+    np.log2(values, out=values)
+    log_tpm_df = pd.DataFrame(values, index=tpm_df.index, columns=tpm_df.columns)
+    del tpm_df
+    log_tpm_df.to_csv('log_tpm.csv', index_label='GeneID', float_format='%.6f')
+    del log_tpm_df, values
     
-    print(f"Generated matrices with {len(gene_ids)} genes and {len(sorted_experiments)} experiments")
+    print(f"Generated matrices with {n_genes} genes and {len(sorted_experiments)} experiments")
 else:
     print("No data to process - creating empty files")
     with open('counts.csv', 'w') as f:
@@ -659,19 +692,18 @@ import pandas as pd
 import numpy as np
 
 print("Reading expression matrices...")
-# Read the three expression matrices
-tpm_df = pd.read_csv('${tpm_matrix}', index_col=0)
-log_tpm_df = pd.read_csv('${log_tpm_matrix}', index_col=0)
+# Read the counts matrix first; the others are filtered and written one at a
+# time below so that only one matrix is held in memory
 counts_df = pd.read_csv('${counts_matrix}', index_col=0)
 
-print(f"Original matrices shape: {tpm_df.shape}")
-print(f"Sample columns: {list(tpm_df.columns)}")
+print(f"Original matrices shape: {counts_df.shape}")
+print(f"Sample columns: {list(counts_df.columns)}")
 
 # Identify samples with >50% zero values
 samples_to_remove = []
-total_genes = len(tpm_df)
+total_genes = len(counts_df)
 
-for sample in tpm_df.columns:
+for sample in counts_df.columns:
     # Count zeros in the counts matrix (most appropriate for this analysis)
     zero_count = (counts_df[sample] == 0).sum()
     zero_percentage = zero_count / total_genes
@@ -684,25 +716,22 @@ for sample in tpm_df.columns:
 
 print(f"\\nSamples to remove ({len(samples_to_remove)}): {samples_to_remove}")
 
-# Filter matrices by removing low-expression samples
+samples_to_keep = [col for col in counts_df.columns if col not in samples_to_remove]
 if samples_to_remove:
-    samples_to_keep = [col for col in tpm_df.columns if col not in samples_to_remove]
-    
-    tpm_filtered = tpm_df[samples_to_keep]
-    log_tpm_filtered = log_tpm_df[samples_to_keep]
-    counts_filtered = counts_df[samples_to_keep]
-    
-    print(f"Filtered matrices shape: {tpm_filtered.shape}")
+    print(f"Filtered matrices shape: {(total_genes, len(samples_to_keep))}")
 else:
     print("No samples need to be removed")
-    tpm_filtered = tpm_df
-    log_tpm_filtered = log_tpm_df  
-    counts_filtered = counts_df
 
-# Save filtered matrices (overwrite originals)
-tpm_filtered.to_csv('tpm.csv')
-log_tpm_filtered.to_csv('log_tpm.csv')
-counts_filtered.to_csv('counts.csv')
+# Filter matrices by removing low-expression samples and save them (overwrite originals)
+def write_filtered(matrix_df, output_file):
+    if samples_to_remove:
+        matrix_df = matrix_df[samples_to_keep]
+    matrix_df.to_csv(output_file)
+
+write_filtered(counts_df, 'counts.csv')
+del counts_df
+write_filtered(pd.read_csv('${tpm_matrix}', index_col=0), 'tpm.csv')
+write_filtered(pd.read_csv('${log_tpm_matrix}', index_col=0), 'log_tpm.csv')
 
 print("Reading and filtering samplesheet...")
 # Read and filter samplesheet with robust CSV parsing
@@ -794,7 +823,7 @@ else:
 samplesheet_filtered.to_csv('samplesheet.csv', index=False)
 
 print("\\nFiltering completed successfully!")
-print(f"Final matrices have {len(tpm_filtered.columns)} samples and {len(tpm_filtered)} genes")
+print(f"Final matrices have {len(samples_to_keep)} samples and {total_genes} genes")
 
 EOF
     """
@@ -14,9 +14,9 @@ Options:
   --cpu             Number of CPUs to allocate per process
   --ref-accession   Optional: specific reference genome accession (e.g., "GCA_008931305.1").
                     If not provided, automatically selects the reference strain for the organism.
-  --strain          Optional: filter metadata by strain token in 'ScientificName'.
-                    Splits ScientificName on spaces and keeps rows where any token equals
-                    or contains the provided string (case-insensitive).
+  --strain          Optional: filter metadata by strain in 'ScientificName'.
+                    Keeps rows whose ScientificName contains the provided string
+                    (case-insensitive substring match).
                     Alias: '-strain' also accepted.
   --max_concurrent_downloads  Optional: Maximum number of concurrent downloads (default: 20)
   -h, --help        Show this help message and exit